@@ -1,6 +1,9 @@
-import os, time, json, re, argparse, datetime as dt
-from typing import Iterator, Dict, List
-import praw
+import os, time, re, argparse, asyncio, queue, datetime as dt
+from collections import Counter
+from threading import Event, Thread
+from typing import AsyncIterator, Iterator, Dict, List, Optional, Set, Tuple
+import aiohttp
+import orjson
 from dotenv import load_dotenv
 import mysql.connector as mysql
 
@@ -12,7 +15,7 @@ def db_conn():
         password=os.getenv("MYSQL_PASSWORD"),
         database=os.getenv("MYSQL_DB", "reddit_db"),
         port=int(os.getenv("MYSQL_PORT", "3306")),
-        autocommit=True,
+        autocommit=False,
     )
 
 UPSERT_SQL = """
@@ -26,80 +29,285 @@ ON DUPLICATE KEY UPDATE
   is_ad=VALUES(is_ad),
   keywords=VALUES(keywords)
 """
+UPSERT_BATCH = 200
 
-# PRAW
-def praw_client():
-    return praw.Reddit(
-        client_id=os.getenv("PRAW_CLIENT_ID"),
-        client_secret=os.getenv("PRAW_CLIENT_SECRET"),
-        user_agent=os.getenv("PRAW_USER_AGENT", "lab5-dscraper/1.0"),
-        ratelimit_seconds=5,
+def upsert_row(rec: Dict) -> tuple:
+    # orjson returns bytes; decode so the driver sends text (MySQL rejects binary-charset JSON)
+    return (
+        rec["platform_id"], rec["subreddit"], rec["author_mask"], rec["title"], rec["selftext"],
+        rec["created_utc"], rec["url"], rec["is_ad"], orjson.dumps(rec["keywords"]).decode(), rec["clean_text"]
     )
 
+def load_seen_ids(cur) -> Set[str]:
+    """platform_ids already stored, so a run can skip posts it would only re-upsert."""
+    cur.execute("SELECT platform_id FROM reddit_posts")
+    return {pid for (pid,) in cur.fetchall()}
+
+def flush_upserts(conn, cur, buf: List[tuple]):
+    if buf:
+        cur.executemany(UPSERT_SQL, buf)
+        conn.commit()
+        buf.clear()
+
+class ProgressMonitor:
+    """Prints `count` every `interval` seconds from a daemon thread, keeping I/O out of the hot loop."""
+
+    def __init__(self, label: str, interval: float = 2.0):
+        self.label = label
+        self.interval = interval
+        self.count = 0
+        self._stop = Event()
+        self._thread = Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            print(f"[INFO] {self.label}: {self.count}")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+# Reddit OAuth (app-only) + JSON listing endpoints
+TOKEN_URL = "https://www.reddit.com/api/v1/access_token"
+LISTING_URL = "https://oauth.reddit.com/r/{sub}/{sort}.json"
+# listing name -> (endpoint sort, extra query params)
+SORTS = {
+    "new": ("new", {}),
+    "hot": ("hot", {}),
+    "top_week": ("top", {"t": "week"}),
+    "top_month": ("top", {"t": "month"}),
+}
+
+def _user_agent() -> str:
+    return os.getenv("PRAW_USER_AGENT", "lab5-dscraper/1.0")
+
+# app-only tokens live ~24h; reuse one across fetch_stream calls instead of re-authing each time
+_TOKEN = {"value": None, "expires": 0.0}
+
+async def _access_token(session: aiohttp.ClientSession) -> str:
+    if _TOKEN["value"] and time.time() < _TOKEN["expires"]:
+        return _TOKEN["value"]
+    auth = aiohttp.BasicAuth(os.getenv("PRAW_CLIENT_ID") or "", os.getenv("PRAW_CLIENT_SECRET") or "")
+    async with session.post(TOKEN_URL, auth=auth, data={"grant_type": "client_credentials"}) as resp:
+        resp.raise_for_status()
+        data = orjson.loads(await resp.read())
+    _TOKEN["value"] = data["access_token"]
+    _TOKEN["expires"] = time.time() + float(data.get("expires_in", 3600)) - 60
+    return _TOKEN["value"]
+
+class TokenBucket:
+    """Spaces requests evenly over Reddit's rate-limit window (default 100 QPM)."""
+
+    def __init__(self, rate_per_min: float = 100):
+        self.interval = 60.0 / rate_per_min
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            now = asyncio.get_running_loop().time()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def update(self, headers):
+        try:
+            remaining = float(headers["X-Ratelimit-Remaining"])
+            reset_s = float(headers["X-Ratelimit-Reset"])
+        except (KeyError, ValueError):
+            return
+        self.interval = reset_s if remaining < 1 else reset_s / remaining
+
 # Preprocessing data: Remove specials/irrelevant, mask usernames, convert time
 _URL = re.compile(r"http\S+")
 _USER = re.compile(r"u/[A-Za-z0-9_-]+")
-_NONWORD = re.compile(r"[^a-z0-9\s]+")
+# runs of word chars; everything between them collapses to one space
+_WORD = re.compile(r"[a-z0-9]+")
 
-def clean_text(s: str) -> str:
+def looks_like_ad(post: Dict) -> bool:
+    flair = (post.get("link_flair_text") or "").lower()
+    return "promo" in flair or "ad" in flair or bool(post.get("stickied"))
+
+def clean_and_keywords(s: str, top_k: int = 10) -> Tuple[str, List[str]]:
+    """Cleaned text plus its top_k most common tokens longer than 3 chars, from one tokenizing scan."""
     s = (s or "").lower()
     s = _URL.sub(" ", s)
     s = _USER.sub("u_user", s)
-    s = _NONWORD.sub(" ", s)
-    s = re.sub(r"\s+", " ", s).strip()
-    return s
+    toks = _WORD.findall(s)
+    keywords = Counter(w for w in toks if len(w) > 3).most_common(top_k)
+    return " ".join(toks), [w for w, _ in keywords]
+
+def to_record(d: Dict) -> Dict:
+    title, body = d.get("title") or "", d.get("selftext") or ""
+    ct, keywords = clean_and_keywords(f"{title} {body}")
+    return {
+        "platform_id": d["id"],
+        "subreddit": d["subreddit"],
+        "author_mask": "u_user",
+        "title": title,
+        "selftext": body,
+        "created_utc": dt.datetime.fromtimestamp(d["created_utc"], dt.timezone.utc),
+        "url": f"https://www.reddit.com{d['permalink']}",
+        "is_ad": False,  # ads are filtered before records are built
+        "clean_text": ct,
+        "keywords": keywords,
+    }
+
+async def _get_json(session: aiohttp.ClientSession, bucket: TokenBucket, url: str,
+                    params: Dict, max_retries: int = 5) -> Dict:
+    for attempt in range(max_retries):
+        await bucket.acquire()
+        try:
+            async with session.get(url, params=params) as resp:
+                bucket.update(resp.headers)
+                if resp.status == 429 or resp.status >= 500:
+                    await asyncio.sleep(2 ** attempt)
+                    continue
+                resp.raise_for_status()
+                return orjson.loads(await resp.read())
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            await asyncio.sleep(2 ** attempt)
+    raise RuntimeError(f"Giving up on {url} after {max_retries} attempts")
+
+async def fetch_stream_async(subreddit: str, total_limit: int, per_batch: int = 1000,
+                             batch_timeout: int = 60, overall_timeout: int = 400,
+                             sorts=tuple(SORTS), workers: int = 32,
+                             seen: Optional[Set[str]] = None) -> AsyncIterator[Dict]:
+    """Pull listings with a pool of workers; `per_batch` caps posts per sort, `batch_timeout` caps one request.
+
+    Post ids are added to `seen` and posts already in it are skipped, so the
+    same post from several sorts (or an earlier call) is only emitted once.
+    """
+    seen = set() if seen is None else seen
+    cursors: asyncio.Queue = asyncio.Queue()
+    output: asyncio.Queue = asyncio.Queue()
+    bucket = TokenBucket()
+    fetched = {name: 0 for name in sorts}
+    for name in sorts:
+        cursors.put_nowait((name, None))
 
-def looks_like_ad(post) -> bool:
-    flair = (post.link_flair_text or "").lower()
-    return "promo" in flair or "ad" in flair or post.stickied
+    async def worker(session: aiohttp.ClientSession):
+        while True:
+            name, after = await cursors.get()
+            try:
+                sort, extra = SORTS[name]
+                params = {"limit": 100, "raw_json": 1, **extra}
+                if after:
+                    params["after"] = after
+                try:
+                    data = (await _get_json(session, bucket, LISTING_URL.format(sub=subreddit, sort=sort), params))["data"]
+                except (RuntimeError, aiohttp.ClientResponseError) as e:
+                    print(f"[WARN] r/{subreddit}/{name}: {e}")
+                    continue
+                children = data.get("children") or []
+                for child in children:
+                    if child["data"]["id"] in seen:
+                        continue
+                    seen.add(child["data"]["id"])
+                    if looks_like_ad(child["data"]):
+                        continue
+                    await output.put(to_record(child["data"]))
+                fetched[name] += len(children)
+                if children and data.get("after") and fetched[name] < per_batch:
+                    cursors.put_nowait((name, data["after"]))
+            finally:
+                cursors.task_done()
 
-def top_keywords_simple(text: str, top_k: int = 10) -> List[str]:
-    toks = [w for w in text.split() if len(w) > 3]
-    freq = {}
-    for w in toks:
-        freq[w] = freq.get(w, 0) + 1
-    return [w for w, _ in sorted(freq.items(), key=lambda x: x[1], reverse=True)[:top_k]]
+    connector = aiohttp.TCPConnector(limit_per_host=16)
+    timeout = aiohttp.ClientTimeout(total=batch_timeout)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                     headers={"User-Agent": _user_agent()}) as session:
+        session.headers["Authorization"] = f"bearer {await _access_token(session)}"
+        tasks = [asyncio.create_task(worker(session)) for _ in range(workers)]
+        drained = asyncio.create_task(cursors.join())
+        deadline = asyncio.get_running_loop().time() + overall_timeout
+        got = 0
+        try:
+            while got < total_limit:
+                if not output.empty():
+                    rec = output.get_nowait()
+                elif drained.done():
+                    break
+                else:
+                    remaining = deadline - asyncio.get_running_loop().time()
+                    if remaining <= 0:
+                        break
+                    getter = asyncio.create_task(output.get())
+                    done, _ = await asyncio.wait({getter, drained}, timeout=remaining,
+                                                 return_when=asyncio.FIRST_COMPLETED)
+                    if getter not in done:
+                        getter.cancel()
+                        continue
+                    rec = getter.result()
+                yield rec
+                got += 1
+        finally:
+            for t in tasks + [drained]:
+                t.cancel()
+            await asyncio.gather(*tasks, drained, return_exceptions=True)
+
+_STREAM_DONE = object()
 
 def fetch_stream(subreddit: str, total_limit: int, per_batch: int = 1000,
-                 batch_timeout: int = 60, overall_timeout: int = 400) -> Iterator[Dict]:
-    reddit = praw_client()
-    sub = reddit.subreddit(subreddit)
-    got = 0
-    overall_start = time.time()
-    after_name = None
-
-    while got < total_limit and (time.time() - overall_start) <= overall_timeout:
-        batch_start = time.time()
-        count_this = 0
-        gen = sub.new(limit=None, params={"after": after_name} if after_name else None)
-        for s in gen:
-            if got >= total_limit:
-                break
-            if count_this >= per_batch or (time.time() - batch_start) > batch_timeout:
+                 batch_timeout: int = 60, overall_timeout: int = 400,
+                 seen: Optional[Set[str]] = None, buffer: int = 2 * UPSERT_BATCH) -> Iterator[Dict]:
+    """Sync view of fetch_stream_async for the upsert loops.
+
+    The event loop runs on a background thread and hands records over through a
+    bounded queue, so records are yielded as they arrive and the caller's upserts
+    overlap with fetching. A full queue pauses the fetch (back-pressure); closing
+    the generator stops it.
+    """
+    records: queue.Queue = queue.Queue(maxsize=buffer)
+    stop = Event()
+
+    async def _produce():
+        stream = fetch_stream_async(subreddit, total_limit, per_batch,
+                                    batch_timeout, overall_timeout, seen=seen)
+        try:
+            async for rec in stream:
+                while not stop.is_set():
+                    try:
+                        records.put_nowait(rec)
+                        break
+                    except queue.Full:
+                        await asyncio.sleep(0.05)
+                if stop.is_set():
+                    break
+        finally:
+            await stream.aclose()
+
+    def _run():
+        try:
+            asyncio.run(_produce())
+            last = _STREAM_DONE
+        except Exception as e:
+            last = e
+        while not stop.is_set():
+            try:
+                records.put(last, timeout=0.5)
                 break
+            except queue.Full:
+                continue
 
-            title, body = s.title or "", s.selftext or ""
-            raw = f"{title} {body}"
-            ct = clean_text(raw)
-            rec = {
-                "platform_id": s.id,
-                "subreddit": str(s.subreddit),
-                "author_mask": "u_user",
-                "title": title,
-                "selftext": body,
-                "created_utc": dt.datetime.fromtimestamp(s.created_utc, dt.timezone.utc),
-                "url": f"https://www.reddit.com{s.permalink}",
-                "is_ad": looks_like_ad(s),
-                "clean_text": ct,
-                "keywords": top_keywords_simple(ct, top_k=10),
-            }
-            yield rec
-            got += 1
-            count_this += 1
-            after_name = f"t3_{s.id}"
-        if count_this == 0:
-            break
-        time.sleep(1.5)
+    producer = Thread(target=_run, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = records.get()
+            if item is _STREAM_DONE:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        producer.join()
 
 def main():
     ap = argparse.ArgumentParser()
@@ -111,18 +319,21 @@ def main():
     conn = db_conn()
     cur = conn.cursor()
 
-    inserted = 0
-    for rec in fetch_stream(args.subreddit, args.limit, per_batch=1000, batch_timeout=60, overall_timeout=args.overall_timeout):
-        if rec["is_ad"]:
-            continue
-        cur.execute(UPSERT_SQL, (
-            rec["platform_id"], rec["subreddit"], rec["author_mask"], rec["title"], rec["selftext"],
-            rec["created_utc"], rec["url"], rec["is_ad"], json.dumps(rec["keywords"]), rec["clean_text"]
-        ))
-        inserted += 1
-        if inserted % 100 == 0:
-            print(f"Upserted {inserted} rows...")
-    print(f"Upserted total rows: {inserted}")
+    buf = []
+    seen = load_seen_ids(cur)
+    with ProgressMonitor("Upserted rows") as progress:
+        try:
+            for rec in fetch_stream(args.subreddit, args.limit, per_batch=1000, batch_timeout=60,
+                                    overall_timeout=args.overall_timeout, seen=seen):
+                buf.append(upsert_row(rec))
+                if len(buf) >= UPSERT_BATCH:
+                    flush_upserts(conn, cur, buf)
+                progress.count += 1
+        finally:
+            flush_upserts(conn, cur, buf)
+            cur.close()
+            conn.close()
+    print(f"Upserted total rows: {progress.count}")
 
 # if __name__ == "__main__":
 #     main()
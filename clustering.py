@@ -1,76 +1,96 @@
-import pandas as pd
-from sklearn.cluster import KMeans
+from sklearn.cluster import MiniBatchKMeans
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.decomposition import PCA
-import seaborn as sns
 import matplotlib.pyplot as plt
 import numpy as np
+from scipy.sparse import csr_matrix
+
+
+_tfidf_cache = {}
+_TFIDF_CACHE_SIZE = 4
+
+
+def _get_tfidf(messages):
+    """Fit (or reuse) the TF-IDF vectorizer and matrix for this exact message set."""
+    key = hash(tuple(messages))
+    if key in _tfidf_cache:
+        return _tfidf_cache[key]
+    vectorizer = TfidfVectorizer(stop_words="english", max_features=2000, dtype=np.float32)
+    tfidf = vectorizer.fit_transform(messages)
+    if len(_tfidf_cache) >= _TFIDF_CACHE_SIZE:
+        _tfidf_cache.pop(next(iter(_tfidf_cache)))
+    _tfidf_cache[key] = (vectorizer, tfidf)
+    return vectorizer, tfidf
 
 
 def cluster_messages(embeddings, messages, n_clusters=5, random_state=42):
-    """Cluster the embeddings and return labels and cluster keywords."""
-    kmeans = KMeans(n_clusters=n_clusters, random_state=random_state)
+    """Cluster the embeddings and return labels, cluster keywords, the fitted MiniBatchKMeans and TF-IDF vectorizer."""
+    kmeans = MiniBatchKMeans(n_clusters=n_clusters, random_state=random_state, batch_size=1024, n_init=3)
     labels = kmeans.fit_predict(embeddings)
 
     # Use TF-IDF to extract keywords
-    vectorizer = TfidfVectorizer(stop_words="english", max_features=2000)
-    tfidf = vectorizer.fit_transform(messages)
+    vectorizer, tfidf = _get_tfidf(messages)
     terms = vectorizer.get_feature_names_out()
     
+    # Per-cluster mean TF-IDF as one sparse (k x N) one-hot @ (N x V) product
+    rows = np.arange(len(labels))
+    onehot = csr_matrix((np.ones(len(labels), dtype=np.float32), (labels, rows)),
+                        shape=(n_clusters, len(labels)))
+    counts = np.asarray(onehot.sum(axis=1)).ravel()
+    means = (onehot @ tfidf).toarray() / np.maximum(counts, 1)[:, None]
+
+    n_top = min(8, len(terms))
+    top_idx = np.argpartition(-means, n_top - 1, axis=1)[:, :n_top]
     keywords = {}
-    
     for cid in range(n_clusters):
-        idxs = idxs = np.where(labels == cid)[0]
-        
-        if len(idxs) == 0:
+        if counts[cid] == 0:
             keywords[cid] = []
             continue
-        
-        mean_vec = tfidf[idxs].mean(axis=0)
-        top_idx = np.array(mean_vec).ravel().argsort()[-8:][::-1]
-        keywords[cid] = [terms[i] for i in top_idx]
+        order = top_idx[cid][np.argsort(-means[cid, top_idx[cid]])]
+        keywords[cid] = [terms[i] for i in order]
 
-    return labels, keywords
+    return labels, keywords, kmeans, vectorizer
 
 
 
-def get_representative_posts(embeddings, labels, ids, random_state=42):
+def _nearest_per_cluster(embeddings, labels, centers):
+    """Index of the point closest to its own center for every cluster (-1 if empty), in one pass."""
+    diff = embeddings - centers[labels]
+    dist = np.einsum("ij,ij->i", diff, diff)
+    # sort by (label, distance); the first row of each label run is its nearest point
+    order = np.lexsort((dist, labels))
+    sorted_labels = labels[order]
+    starts = np.flatnonzero(np.r_[True, sorted_labels[1:] != sorted_labels[:-1]])
+    best = np.full(centers.shape[0], -1, dtype=np.int64)
+    best[sorted_labels[starts]] = order[starts]
+    return best
+
+
+def get_representative_posts(embeddings, labels, ids, kmeans):
     """Findout the representative message that closest to the centroid in each cluster"""
-    k = len(np.unique(labels))
-    km = KMeans(n_clusters=k, random_state=random_state).fit(embeddings)
-    reps = {}
-    
-    for cid in range(k):
-        idxs = np.where(labels == cid)[0]
-        if len(idxs) == 0:
-            reps[cid] = None
-            continue
-        center = km.cluster_centers_[cid]
-        closest = idxs[np.argmin(np.linalg.norm(embeddings[idxs] - center, axis=1))]
-        reps[cid] = ids[closest]
-    
-    return reps
+    labels = np.asarray(labels)
+    best = _nearest_per_cluster(embeddings, labels, kmeans.cluster_centers_)
+    return {cid: (ids[i] if i >= 0 else None) for cid, i in enumerate(best)}
 
 def visualize_clusters(embeddings, labels, keywords, filename="clusters.png"):
     """Turn embeddings into 2D with PCA, and plot the scatter plot."""
-    pca = PCA(n_components=2)
-    reduced = pca.fit_transform(embeddings)
+    pca = PCA(n_components=2, svd_solver="randomized", random_state=42)
+    reduced = pca.fit_transform(np.asarray(embeddings, dtype=np.float32))
     
-    df = pd.DataFrame({
-        "x": reduced[:, 0],
-        "y": reduced[:, 1],
-        "cluster": labels
-    })
+    labels = np.asarray(labels)
     
     plt.figure(figsize=(8, 6))
     
-    cluster_names = {cid: ", ".join(kws[:3]) for cid, kws in keywords.items()}
-    df["cluster_name"] = df["cluster"].map(cluster_names)
-    
-    sns.scatterplot(
-        data=df, x="x", y="y", hue="cluster_name",
-        palette="Set2", s=50, alpha=0.85, edgecolor='none'
-    )
+    # one scatter call per cluster so the legend shows cluster names
+    cmap = plt.get_cmap("Set2")
+    for cid, kws in keywords.items():
+        mask = labels == cid
+        if not mask.any():
+            continue
+        plt.scatter(
+            reduced[mask, 0], reduced[mask, 1], color=cmap(cid % cmap.N),
+            label=", ".join(kws[:3]), s=50, alpha=0.85, edgecolors='none'
+        )
     plt.title("Message Clusters", fontsize=14)
     plt.legend(title="Cluster", bbox_to_anchor=(1.02, 1), loc="upper left")
     plt.tight_layout()
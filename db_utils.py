@@ -1,12 +1,18 @@
 import os
-import json
-import mysql.connector as mysql
+import orjson
+import numpy as np
+from mysql.connector.pooling import MySQLConnectionPool
 from dotenv import load_dotenv
 
 load_dotenv()
 
-def db_conn():
-    return mysql.connect(
+_POOL = None
+
+# On-disk embedding encoding: raw little-endian float16 (2 bytes/dim)
+EMBEDDING_DTYPE = np.dtype('<f2')
+
+def _cfg():
+    return dict(
         host=os.getenv("MYSQL_HOST", "localhost"),
         user=os.getenv("MYSQL_USER"),
         password=os.getenv("MYSQL_PASSWORD"),
@@ -15,9 +21,19 @@ def db_conn():
         autocommit=True,
     )
 
+def get_pool():
+    global _POOL
+    if _POOL is None:
+        # main's session connection + embedding producer/consumer threads + headroom
+        _POOL = MySQLConnectionPool(pool_name="reddit", pool_size=8, **_cfg())
+    return _POOL
+
+def db_conn():
+    """Pooled connection; close() hands it back to the pool."""
+    return get_pool().get_connection()
 
-def load_from_db(limit=2000):
-    conn = db_conn()
+
+def load_from_db(conn, limit=2000):
     cur = conn.cursor()
     cur.execute(
         "SELECT id, clean_text, embedding FROM reddit_posts "
@@ -28,24 +44,25 @@ def load_from_db(limit=2000):
     for rid, msg, emb in rows:
         ids.append(rid)
         messages.append(msg)
-        embeddings.append(json.loads(emb) if emb else None)
+        embeddings.append(np.frombuffer(emb, dtype=EMBEDDING_DTYPE) if emb else None)
+    cur.close()
     return ids, messages, embeddings
 
 
-def save_clusters_to_db(post_ids, labels):
-    conn = db_conn()
+def save_clusters_to_db(conn, post_ids, labels):
+    conn.start_transaction()
     cur = conn.cursor()
-    for pid, lid in zip(post_ids, labels):
-        cur.execute(
-            "UPDATE reddit_posts SET cluster_id = %s WHERE id = %s",
-            (int(lid), int(pid))
-        )
+    cur.executemany(
+        "UPDATE reddit_posts SET cluster_id = %s WHERE id = %s",
+        [(int(lid), int(pid)) for pid, lid in zip(post_ids, labels)]
+    )
     conn.commit()
+    cur.close()
     print(f"[INFO] Updated {len(post_ids)} posts with cluster assignments")
 
     
-def save_cluster_metadata(keywords_dict, reps_dict):
-    conn = db_conn()
+def save_cluster_metadata(conn, keywords_dict, reps_dict):
+    conn.start_transaction()
     cur = conn.cursor()
     for cid, kws in keywords_dict.items():
         rep_post = reps_dict.get(cid)
@@ -57,7 +74,8 @@ def save_cluster_metadata(keywords_dict, reps_dict):
               keywords = VALUES(keywords),
               representative_post_id = VALUES(representative_post_id)
             """,
-            (int(cid), json.dumps(kws), int(rep_post) if rep_post else None)
+            (int(cid), orjson.dumps(kws).decode(), int(rep_post) if rep_post else None)
         )
     conn.commit()
+    cur.close()
     print(f"[INFO] Saved metadata for {len(keywords_dict)} clusters")
\ No newline at end of file
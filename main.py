@@ -1,94 +1,160 @@
 import os
 import time
-import json
+import hashlib
+import joblib
 import numpy as np
 import argparse
+import asyncio
 
 #  Import data collection code
-from DSCI560_Lab5_Data_collection import fetch_stream, db_conn, UPSERT_SQL
+from DSCI560_Lab5_Data_collection import fetch_stream, load_seen_ids, upsert_row, flush_upserts, UPSERT_BATCH, ProgressMonitor
 
 #  Import data preprocessing
 from preprocessing import RedditPreprocessor
 
 # Database helper functions
-from db_utils import load_from_db, save_clusters_to_db, save_cluster_metadata
+from db_utils import db_conn, load_from_db, save_clusters_to_db, save_cluster_metadata
 
 # Import clustering
 from clustering import cluster_messages, get_representative_posts, visualize_clusters
 
 
-def collection_phase(subreddit, duration_min=5, poll_pause=5, max_total=5000, overall_timeout=400):
-    conn = db_conn()
+def collection_phase(conn, subreddit, duration_min=5, max_total=5000, overall_timeout=400):
     cur = conn.cursor()
-    start = time.time()
-    pulls = 0
+    start = time.monotonic()
+    buf = []
+    seen = load_seen_ids(cur)
     print(f"[INFO] Collecting from r/{subreddit} for {duration_min} min...")
     
-    while True:
-        # Stop Conditions
-        if (time.time() - start) >= duration_min * 60:
-            break
-        if (time.time() - start) >= overall_timeout:
-            break
-        if pulls >= max_total:
-            break
-        for rec in fetch_stream(subreddit, total_limit=max_total, overall_timeout=overall_timeout):
-            if rec["is_ad"]:
-                continue
-            
-            cur.execute(UPSERT_SQL, (
-                rec["platform_id"], rec["subreddit"], rec["author_mask"], rec["title"],
-                rec["selftext"], rec["created_utc"], rec["url"], rec["is_ad"],
-                json.dumps(rec["keywords"]), rec["clean_text"]
-            ))
-            pulls += 1
-
-            # check limitations again
-            if pulls >= max_total:
-                break
-            if (time.time() - start) >= duration_min * 60:
-                break
-            if (time.time() - start) >= overall_timeout:
-                break
-
-        print(f"[INFO] Pulled {pulls} posts so far...")
-        time.sleep(poll_pause)
+    # Single pass: fetch_stream owns the post and time budget (stop conditions)
+    with ProgressMonitor("Pulled posts") as progress:
+        for rec in fetch_stream(subreddit, total_limit=max_total,
+                                overall_timeout=min(duration_min * 60, overall_timeout), seen=seen):
+            buf.append(upsert_row(rec))
+            progress.count += 1
+            if len(buf) >= UPSERT_BATCH:
+                flush_upserts(conn, cur, buf)
+    pulls = progress.count
                 
-    elapsed = int(time.time() - start)
+    elapsed = int(time.monotonic() - start)
     print(f"[INFO] Collection finished: {pulls} posts in {elapsed} sec.")
     
     print("[INFO] Committing changes to the database...")
-    conn.commit()
+    flush_upserts(conn, cur, buf)
     cur.close()
-    conn.close()
-    print("[INFO] Database connection closed.")
         
 
                 
 # Embedding
-def embedding_phase(batch_size=50):
+def embedding_phase(batch_size=50, prefetch=2):
     print("[INFO] Generating embeddings...")
-    pre = RedditPreprocessor()
-    pre.process_all_posts(batch_size=batch_size)
-    print("[INFO] Embeddings saved to DB.")
+    with RedditPreprocessor() as pre:
+        # Load or fit the model before paging: a first fit re-queues every stored post
+        pre.get_doc2vec()
+        # Fork the OCR workers before asyncio.to_thread starts any threads
+        pre.start_ocr_pool()
+        total = asyncio.run(_embed_all(pre, batch_size, prefetch))
+    print(f"[INFO] Embeddings saved to DB ({total} posts).")
+
+
+async def _embed_all(pre, batch_size, prefetch):
+    # DB reads (producer) overlap with OCR + Doc2Vec (consumer) through a small prefetch queue
+    q = asyncio.Queue(maxsize=prefetch)
+
+    async def producer():
+        last_id = 0
+        while True:
+            posts = await asyncio.to_thread(pre.fetch_posts_batch, batch_size, last_id)
+            if not posts:
+                break
+            await q.put(posts)
+            last_id = posts[-1][0]
+        await q.put(None)
+
+    async def consumer():
+        total = 0
+        while (posts := await q.get()) is not None:
+            total += await asyncio.to_thread(pre.embed_and_store, posts)
+        return total
+
+    _, total = await asyncio.gather(producer(), consumer())
+    return total
             
 
+# Clustering results cached by (ids, embeddings, n_clusters): in memory, and on disk across restarts
+_CLUSTER_CACHE = {}
+_CLUSTER_CACHE_SIZE = 8
+# Private per-user directory: cache files are unpickled, so nobody else may be able to write them
+CLUSTER_CACHE_DIR = os.getenv("CLUSTER_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "dsci560_lab5"))
+
+def _cluster_cache_dir():
+    """CLUSTER_CACHE_DIR, or None (no disk cache) if it is not a directory only we can write to"""
+    try:
+        os.makedirs(CLUSTER_CACHE_DIR, mode=0o700, exist_ok=True)
+        st = os.stat(CLUSTER_CACHE_DIR)
+    except OSError:
+        return None
+    if st.st_mode & 0o022 or (hasattr(os, "getuid") and st.st_uid != os.getuid()):
+        print(f"[WARN] {CLUSTER_CACHE_DIR} is writable by others; not using the clustering disk cache.")
+        return None
+    return CLUSTER_CACHE_DIR
+
+def _prune_cluster_cache(cache_dir):
+    """Keep only the _CLUSTER_CACHE_SIZE most recently used km_*.pkl files"""
+    files = [e for e in os.scandir(cache_dir) if e.name.startswith("km_") and e.name.endswith(".pkl")]
+    files.sort(key=lambda e: e.stat().st_mtime, reverse=True)
+    for e in files[_CLUSTER_CACHE_SIZE:]:
+        try:
+            os.remove(e.path)
+        except OSError:
+            pass
+
+def cached_cluster(ids, X, messages, n_clusters):
+    h = hashlib.blake2b(np.asarray(ids, dtype=np.int64).tobytes())
+    h.update(X.tobytes())
+    h.update(int(n_clusters).to_bytes(4, "little"))
+    key = h.hexdigest()
+    if key in _CLUSTER_CACHE:
+        print("[INFO] Reusing cached clustering.")
+        return _CLUSTER_CACHE[key]
+
+    cache_dir = _cluster_cache_dir()
+    path = os.path.join(cache_dir, f"km_{key}.pkl") if cache_dir else None
+    if path and os.path.exists(path):
+        print(f"[INFO] Loading cached clustering from {path}")
+        result = joblib.load(path)
+        os.utime(path)  # mark as recently used for pruning
+    else:
+        result = cluster_messages(X, messages, n_clusters=n_clusters)
+        if path:
+            joblib.dump(result, path)
+            _prune_cluster_cache(cache_dir)
+
+    if len(_CLUSTER_CACHE) >= _CLUSTER_CACHE_SIZE:
+        _CLUSTER_CACHE.pop(next(iter(_CLUSTER_CACHE)))
+    _CLUSTER_CACHE[key] = result
+    return result
+
+
 # Clustering + Visualization
-def processing_phase(cluster_limit=2000, n_clusters=5):
-    ids, messages, embeddings = load_from_db(limit=cluster_limit)
-    triples = [(i, m, e) for i, m, e in zip(ids, messages, embeddings) if e]
+def processing_phase(conn, cluster_limit=2000, n_clusters=5):
+    ids, messages, embeddings = load_from_db(conn, limit=cluster_limit)
+    triples = [(i, m, e) for i, m, e in zip(ids, messages, embeddings) if e is not None]
     if not triples:
         print("[WARN] No embeddings found, skip clustering.")
         return None, None, None
     
     ids_f, msgs_f, embs_f = zip(*triples)
-    X = np.array(embs_f, dtype=float)
+    # one contiguous float32 allocation, float16 rows widened as they are copied in
+    X = np.empty((len(embs_f), len(embs_f[0])), dtype=np.float32)
+    for i, e in enumerate(embs_f):
+        X[i] = e
     
-    labels, keywords = cluster_messages(X, list(msgs_f), n_clusters=n_clusters)
-    reps = get_representative_posts(X, labels, list(ids_f))
+    labels, keywords, kmeans, _ = cached_cluster(ids_f, X, list(msgs_f), n_clusters)
+    reps = get_representative_posts(X, labels, list(ids_f), kmeans)
     
-    save_clusters_to_db(list(ids_f), list(labels))
-    save_cluster_metadata(keywords, reps)
+    save_clusters_to_db(conn, list(ids_f), list(labels))
+    save_cluster_metadata(conn, keywords, reps)
     
     visualize_clusters(X, labels, keywords)
     print("[INFO] Processing done (cluster.png saved)")
@@ -96,6 +162,7 @@ def processing_phase(cluster_limit=2000, n_clusters=5):
     
     
 def cli_mode(labels, keywords, reps, ids=None, messages=None):
+    id_to_idx = {i: k for k, i in enumerate(ids)} if ids else {}
     while True:
         user_input = input("\nEnter keyword/message | 'resume' | 'exit': ").strip()
         if user_input.lower() == 'exit':
@@ -119,14 +186,12 @@ def cli_mode(labels, keywords, reps, ids=None, messages=None):
             
             # show representative message/post
             rep_id = reps.get(found)
-            rep_msg = None
-            if ids and messages and rep_id in ids:
-                idx = ids.index(rep_id)
-                rep_msg = messages[idx]
+            rep_idx = id_to_idx.get(rep_id)
+            rep_msg = messages[rep_idx] if messages and rep_idx is not None else None
             print(f"Representative post: {rep_msg if rep_msg else rep_id}")
             
             # Show some messages in this cluster
-            cluster_msgs = [m for i, m in zip(ids, messages) if labels[ids.index(i)] == found]
+            cluster_msgs = [messages[k] for k, lb in enumerate(labels) if lb == found] if messages else []
             print("Cluster messages (sample):")
             for sample in cluster_msgs[:5]:
                 print(" -", sample[:120], "..." if len(sample) > 120 else "")
@@ -139,32 +204,42 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--subreddit", required=True,  help="e.g., tech or cybersecurity")
     parser.add_argument("--interval", type=int, help="Collection window (minutes)")
-    parser.add_argument("--poll_pause", type=int, default=5)
+    parser.add_argument("--poll_pause", type=int, default=5, help="Unused; collection runs as a single pass")
     parser.add_argument("--max_total", type=int, default=5000, help="Maximum total posts to fetch")
     parser.add_argument("--overall_timeout", type=int, default=400, help="Maximum seconds to run collection")
     parser.add_argument("--cluster_limit", type=int, default=2000)
     parser.add_argument("--n_clusters", type=int, default=5)
     args = parser.parse_args()
     
-    while True:
-        # 1) Collecting new posts
-        collection_phase(
-            args.subreddit, 
-            duration_min=args.interval, 
-            max_total=args.max_total, 
-            overall_timeout=args.overall_timeout
-        )
-        # 2) Run embedding
-        embedding_phase(batch_size=50)
-        
-        # 3) 3) Run clustering + visualization
-        labels, keywords, reps, ids, messages = processing_phase(cluster_limit=args.cluster_limit, n_clusters=args.n_clusters)
-        
-        # 4) CLI
-        action = cli_mode(labels, keywords, reps, ids, messages)
-        if action == 'exit':
-            print("[INFO] Exiting program.")
-            break
+    # One connection for the whole session; phases share it
+    conn = db_conn()
+    try:
+        while True:
+            # the CLI can sit idle for a long time, so revive the connection if the server dropped it
+            conn.ping(reconnect=True)
+
+            # 1) Collecting new posts
+            collection_phase(
+                conn,
+                args.subreddit, 
+                duration_min=args.interval, 
+                max_total=args.max_total, 
+                overall_timeout=args.overall_timeout
+            )
+            # 2) Run embedding
+            embedding_phase(batch_size=50)
+            
+            # 3) 3) Run clustering + visualization
+            labels, keywords, reps, ids, messages = processing_phase(conn, cluster_limit=args.cluster_limit, n_clusters=args.n_clusters)
+            
+            # 4) CLI
+            action = cli_mode(labels, keywords, reps, ids, messages)
+            if action == 'exit':
+                print("[INFO] Exiting program.")
+                break
+    finally:
+        conn.close()
+        print("[INFO] Database connection closed.")
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
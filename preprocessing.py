@@ -1,18 +1,221 @@
-import os, re, json, logging, argparse
+import os, re, logging, argparse, tempfile, hashlib
 from typing import List, Dict, Tuple
-import mysql.connector as mysql
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from dotenv import load_dotenv
 import html
 from bs4 import BeautifulSoup
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from PIL import Image
 from io import BytesIO
 import pytesseract
 import numpy as np
 from gensim.models.doc2vec import Doc2Vec, TaggedDocument
+from db_utils import EMBEDDING_DTYPE, db_conn
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = frozenset({'jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp'})
+MAX_IMAGE_BYTES = 5 * 1024 * 1024
+DOC2VEC_MODEL_PATH = os.getenv("DOC2VEC_MODEL_PATH", "doc2vec.model")
+
+# Longest Retry-After (seconds) an image host can make a download wait; the request timeout does not cover it
+MAX_RETRY_AFTER = 5
+
+
+class _CappedRetry(Retry):
+    """Retry that honours Retry-After only up to MAX_RETRY_AFTER, so one host can't stall a whole batch"""
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        return None if retry_after is None else min(retry_after, MAX_RETRY_AFTER)
+
+
+# Shared keep-alive session for image downloads (used from the download thread pool)
+_SESSION = requests.Session()
+_SESSION.headers['User-Agent'] = 'Mozilla/5.0 (compatible; RedditScraper/1.0)'
+_adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32,
+                       max_retries=_CappedRetry(total=2, backoff_factor=0.5, status_forcelist=(429, 502, 503, 504)))
+_SESSION.mount('https://', _adapter)
+_SESSION.mount('http://', _adapter)
+
+
+def is_image_url(url: str) -> bool:
+    return url.rsplit('.', 1)[-1].lower() in IMAGE_EXTENSIONS
+
+
+def download_image(url: str):
+    """
+    Download an image URL for OCR
+    Module-level so it can run on worker pools
+    
+    Returns:
+        Raw image bytes, or None if the URL is not an image / the request failed
+    """
+    try:
+        # Check if URL points to an image
+        if not is_image_url(url):
+            return None
+        
+        # Stream so the body is only read once the headers say it is a reasonably sized image
+        with _SESSION.get(url, timeout=15, stream=True) as response:
+            if response.status_code != 200:
+                return None
+            if not response.headers.get('Content-Type', '').startswith('image/'):
+                return None
+            if int(response.headers.get('Content-Length') or 0) > MAX_IMAGE_BYTES:
+                return None
+            
+            content = bytearray()
+            for block in response.iter_content(chunk_size=64 * 1024):
+                content += block
+                if len(content) > MAX_IMAGE_BYTES:
+                    return None
+            return bytes(content)
+    
+    except Exception as e:
+        logger.debug(f"Image download failed for {url}: {str(e)}")
+    
+    return None
+
+
+def ocr_image_bytes(content: bytes) -> str:
+    """
+    Run pytesseract OCR on downloaded image bytes
+    Module-level (picklable) so it can run in a process pool
+    
+    Returns:
+        Extracted text or empty string
+    """
+    try:
+        # Image.open only parses the header, so checking the mode is cheap
+        image = Image.open(BytesIO(content))
+        
+        if image.mode in ('RGB', 'L'):
+            # Fast path: let tesseract (Leptonica) decode the compressed file itself
+            with tempfile.NamedTemporaryFile(suffix='.img') as tmp:
+                tmp.write(content)
+                tmp.flush()
+                return _clean_ocr_output(pytesseract.image_to_string(tmp.name, lang='eng'))
+        
+        # Palette/alpha/CMYK modes still need a Pillow conversion before OCR
+        image = image.convert('RGB')
+        return _clean_ocr_output(pytesseract.image_to_string(image, lang='eng'))
+    
+    except Exception as e:
+        logger.debug(f"OCR failed: {str(e)}")
+    
+    return ""
+
+
+def ocr_image_batch(contents: List[bytes]) -> List[str]:
+    """
+    OCR several images with a single tesseract invocation
+    Tesseract accepts a text file listing image paths and separates the pages of
+    its output with form feeds, so process start-up and model load are paid once
+    per batch instead of once per image
+    
+    Returns:
+        Extracted text per image (same order as contents)
+    """
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = []
+            for i, content in enumerate(contents):
+                path = os.path.join(tmp, f"{i}.img")
+                with open(path, 'wb') as f:
+                    f.write(content)
+                paths.append(path)
+            listing = os.path.join(tmp, 'images.txt')
+            with open(listing, 'w') as f:
+                f.write('\n'.join(paths))
+            
+            pages = pytesseract.image_to_string(listing, lang='eng').split('\x0c')
+        
+        # One form feed per page; multi-frame or unreadable images break the alignment
+        if len(pages) == len(contents) + 1:
+            return [_clean_ocr_output(page) for page in pages[:-1]]
+        logger.debug(f"Batch OCR returned {len(pages) - 1} pages for {len(contents)} images; retrying one by one")
+    
+    except Exception as e:
+        logger.debug(f"Batch OCR failed: {str(e)}")
+    
+    return [ocr_image_bytes(content) for content in contents]
+
+
+def _clean_ocr_output(extracted_text: str) -> str:
+    if extracted_text:
+        # Clean OCR output: collapse newlines/whitespace runs (incl. tesseract's \f page breaks)
+        # and strip in one C-level pass
+        extracted_text = ' '.join(extracted_text.split())
+        
+        # Filter very short results (likely noise)
+        if len(extracted_text) >= 5:
+            return extracted_text
+    return ""
+
+
+def extract_text_from_images(url: str) -> str:
+    """Download + OCR a single image URL"""
+    content = download_image(url)
+    return ocr_image_bytes(content) if content else ""
+
+
+def _doc2vec_tokens(doc: str):
+    """
+    Doc2Vec tokens for a document, or None if it is too short to embed
+    Lowercasing stays: cleaned text is lowercase except the [URL]/[USER]/... placeholders
+    """
+    doc = doc.strip() if doc else ""
+    if len(doc) <= 10:
+        return None
+    return doc.lower().split()
+
+
+# Keep each multi-row UPDATE well below MySQL's default max_allowed_packet (64MB)
+MAX_STATEMENT_BYTES = 16 * 1024 * 1024
+
+
+def _multi_row_update_sql(n_rows: int) -> str:
+    """
+    UPDATE ... JOIN a UNION ALL derived table of n_rows (id, clean_text, embedding, ocr_text)
+    Only new columns are touched: clean_text, embedding, ocr_text, processed (NOT keywords or is_ad)
+    """
+    # The connector quotes bytes as a plain string literal; without the cast the materialized
+    # derived table would type the float16 blobs as utf8mb4 text and reject/mangle them
+    derived = " UNION ALL ".join(
+        ["SELECT %s AS id, %s AS clean_text, CAST(%s AS BINARY) AS embedding, %s AS ocr_text"]
+        + ["SELECT %s, %s, CAST(%s AS BINARY), %s"] * (n_rows - 1)
+    )
+    return (
+        f"UPDATE reddit_posts r JOIN ({derived}) t ON r.id = t.id "
+        "SET r.clean_text = t.clean_text, r.embedding = t.embedding, r.ocr_text = t.ocr_text, "
+        "r.processed = TRUE"
+    )
+
+
+def _packet_chunks(rows: List[Tuple]):
+    """Split rows so each chunk's payload stays under MAX_STATEMENT_BYTES"""
+    chunk, size = [], 0
+    for row in rows:
+        row_size = sum(len(v) for v in row if isinstance(v, (str, bytes))) + 64
+        if chunk and size + row_size > MAX_STATEMENT_BYTES:
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(row)
+        size += row_size
+    if chunk:
+        yield chunk
+
+
+def _ocr_worker_init():
+    # One tesseract thread per worker process; the pool provides the parallelism
+    os.environ['OMP_THREAD_LIMIT'] = '1'
+
+
 class RedditPreprocessor:
     """
     Focused Reddit Preprocessing & Feature Engineering
@@ -34,16 +237,48 @@ class RedditPreprocessor:
         # Regex patterns focused on text cleaning
         self.cleaning_patterns = {
             'html_tags': re.compile(r'<[^>]+>'),
-            'urls': re.compile(r'http[s]?://\S+'),
-            'reddit_users': re.compile(r'/?u/[A-Za-z0-9_-]+'),
-            'reddit_subs': re.compile(r'/?r/[A-Za-z0-9_-]+'),
-            'emails': re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'),
-            'extra_spaces': re.compile(r'\s+'),
-            'special_chars': re.compile(r'[^\w\s]')  # Conservative special char cleaning
+            'special_chars': re.compile(r'[^\w\s]+'),  # Conservative special char cleaning
+            # urls / reddit users / subreddits / emails in one alternation (one scan);
+            # the group name is the placeholder each match is replaced with
+            'placeholders': re.compile(
+                r'(?P<URL>http[s]?://\S+)'
+                r'|(?P<USER>/?u/[A-Za-z0-9_-]+)'
+                r'|(?P<SUBREDDIT>/?r/[A-Za-z0-9_-]+)'
+                r'|(?P<EMAIL>\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b)'
+            ),
         }
         
+        # Doc2Vec model shared by all batches (loaded or trained lazily)
+        self.doc2vec = None
+        
+        # OCR worker processes shared by all batches of a run (see start_ocr_pool)
+        self._ocr_pool = None
+        
         self.logger.info("Initialized focused RedditPreprocessor")
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def start_ocr_pool(self) -> ProcessPoolExecutor:
+        """
+        Start the OCR process pool once and reuse it for every batch
+        Call before any other threads start: forking a multi-threaded process can deadlock
+        """
+        if self._ocr_pool is None:
+            self._ocr_pool = ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=_ocr_worker_init)
+            # Workers are started on the first submit; do that now instead of mid-batch
+            self._ocr_pool.submit(int).result()
+        return self._ocr_pool
+
+    def close(self):
+        """Shut down the OCR process pool"""
+        if self._ocr_pool is not None:
+            self._ocr_pool.shutdown()
+            self._ocr_pool = None
+
     def _setup_logging(self):
         logging.basicConfig(
             level=logging.INFO,
@@ -52,14 +287,8 @@ class RedditPreprocessor:
         return logging.getLogger(__name__)
 
     def db_connection(self):
-        return mysql.connect(
-            host=os.getenv("MYSQL_HOST", "localhost"),
-            user=os.getenv("MYSQL_USER"),
-            password=os.getenv("MYSQL_PASSWORD"),
-            database=os.getenv("MYSQL_DB", "reddit_db"),
-            port=int(os.getenv("MYSQL_PORT", "3306")),
-            autocommit=True,
-        )
+        """Connection from the shared db_utils pool; close() returns it to the pool"""
+        return db_conn()
 
     def clean_html_content(self, text: str) -> str:
         """
@@ -72,6 +301,10 @@ class RedditPreprocessor:
         # Decode HTML entities first
         text = html.unescape(text)
         
+        # Plain text (most Reddit posts) has no markup to strip, so skip the parser entirely
+        if '<' not in text:
+            return text
+        
         # Remove HTML tags using BeautifulSoup for accuracy
         try:
             soup = BeautifulSoup(text, 'html.parser')
@@ -93,42 +326,90 @@ class RedditPreprocessor:
         Returns:
             Extracted text or empty string
         """
-        try:
-            # Check if URL points to an image
-            image_extensions = ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp']
-            if not any(url.lower().endswith(ext) for ext in image_extensions):
-                return ""
-            
-            # Download image with timeout and proper headers
-            headers = {'User-Agent': 'Mozilla/5.0 (compatible; RedditScraper/1.0)'}
-            response = requests.get(url, timeout=15, headers=headers)
-            
-            if response.status_code != 200:
-                return ""
-            
-            # Open and process image
-            image = Image.open(BytesIO(response.content))
-            
-            # Convert to RGB if needed for OCR
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            
-            # Extract text using OCR
-            extracted_text = pytesseract.image_to_string(image, lang='eng')
-            
-            if extracted_text:
-                # Clean OCR output
-                extracted_text = re.sub(r'\n+', ' ', extracted_text)
-                extracted_text = re.sub(r'\s+', ' ', extracted_text).strip()
-                
-                # Filter very short results (likely noise)
-                if len(extracted_text) >= 5:
-                    return extracted_text
-            
-        except Exception as e:
-            self.logger.debug(f"OCR failed for {url}: {str(e)}")
+        return extract_text_from_images(url)
+
+    def ocr_urls(self, urls: List[str], conn, chunk_size: int = 8) -> Dict[str, str]:
+        """
+        OCR many image URLs at once: downloads run on a thread pool (network bound)
+        and finished downloads are handed in chunks of `chunk_size` to a process
+        pool where each chunk is one batch tesseract call (CPU bound), so the two
+        stages overlap.
         
-        return ""
+        Returns:
+            Mapping url -> extracted text ("" when not an image / no text)
+        """
+        urls = list(dict.fromkeys(u for u in urls if u))
+        results = {u: "" for u in urls}
+        image_urls = [u for u in urls if is_image_url(u)]
+        if not image_urls:
+            return results
+        
+        # Reposts / cross-posts share image URLs: reuse earlier OCR results from ocr_cache
+        url_keys = {u: hashlib.sha1(u.encode()).hexdigest() for u in image_urls}
+        cached = self._load_ocr_cache(conn, list(url_keys.values()))
+        todo = []
+        for u in image_urls:
+            if url_keys[u] in cached:
+                results[u] = cached[url_keys[u]]
+            else:
+                todo.append(u)
+        if not todo:
+            return results
+        
+        fetched = []
+        ocr_pool = self.start_ocr_pool()
+        with ThreadPoolExecutor(max_workers=16) as downloads:
+            pending = {downloads.submit(download_image, u): u for u in todo}
+            # Identical image bytes behind different URLs are only OCR'd once
+            urls_by_digest = {}
+            ocr_jobs = []
+            chunk_digests, chunk = [], []
+            for fut in as_completed(pending):
+                content = fut.result()
+                if not content:
+                    continue
+                url = pending[fut]
+                fetched.append(url)
+                digest = hashlib.blake2b(content, digest_size=16).digest()
+                if digest in urls_by_digest:
+                    urls_by_digest[digest].append(url)
+                    continue
+                urls_by_digest[digest] = [url]
+                chunk_digests.append(digest)
+                chunk.append(content)
+                if len(chunk) >= chunk_size:
+                    ocr_jobs.append((chunk_digests, ocr_pool.submit(ocr_image_batch, chunk)))
+                    chunk_digests, chunk = [], []
+            if chunk:
+                ocr_jobs.append((chunk_digests, ocr_pool.submit(ocr_image_batch, chunk)))
+            for job_digests, job in ocr_jobs:
+                for digest, text in zip(job_digests, job.result()):
+                    for url in urls_by_digest[digest]:
+                        results[url] = text
+        
+        self._store_ocr_cache(conn, [(url_keys[u], results[u]) for u in fetched])
+        return results
+
+    def _load_ocr_cache(self, conn, url_hashes: List[str]) -> Dict[str, str]:
+        """Cached OCR text keyed by sha1(url)"""
+        if not url_hashes:
+            return {}
+        cursor = conn.cursor()
+        placeholders = ", ".join(["%s"] * len(url_hashes))
+        cursor.execute(
+            f"SELECT url_sha1, ocr_text FROM ocr_cache WHERE url_sha1 IN ({placeholders})",
+            tuple(url_hashes)
+        )
+        cached = {key: text or "" for key, text in cursor.fetchall()}
+        cursor.close()
+        return cached
+
+    def _store_ocr_cache(self, conn, rows: List[Tuple[str, str]]):
+        if not rows:
+            return
+        cursor = conn.cursor()
+        cursor.executemany("INSERT IGNORE INTO ocr_cache (url_sha1, ocr_text) VALUES (%s, %s)", rows)
+        cursor.close()
 
     def enhanced_text_cleaning(self, text: str) -> str:
         """
@@ -144,129 +425,214 @@ class RedditPreprocessor:
         # Remove HTML content (not done in data collection)
         text = self.clean_html_content(text)
         
-        # Replace URLs with placeholder to preserve context
-        text = self.cleaning_patterns['urls'].sub(' [URL] ', text)
-        
-        # Anonymize users and subreddits (enhancing data collection anonymization)
-        text = self.cleaning_patterns['reddit_users'].sub(' [USER] ', text)
-        text = self.cleaning_patterns['reddit_subs'].sub(' [SUBREDDIT] ', text)
-        
-        # Remove email addresses for privacy
-        text = self.cleaning_patterns['emails'].sub(' [EMAIL] ', text)
+        # In one pass: replace URLs with placeholder to preserve context,
+        # anonymize users and subreddits (enhancing data collection anonymization)
+        # and remove email addresses for privacy
+        text = self.cleaning_patterns['placeholders'].sub(lambda m: f' [{m.lastgroup}] ', text)
         
         # Conservative special character removal (preserve sentence structure)
         text = self.cleaning_patterns['special_chars'].sub(' ', text)
         
-        # Normalize whitespace
-        text = self.cleaning_patterns['extra_spaces'].sub(' ', text)
-        text = text.strip()
+        # Normalize whitespace (str.split collapses runs and strips in one C pass)
+        text = ' '.join(text.split())
         
         return text
 
-    def generate_doc2vec_embeddings(self, documents: List[str]) -> Tuple[List[List[float]], Doc2Vec]:
+    def post_embedding_text(self, title: str, selftext: str, ocr_text: str) -> str:
+        """
+        Cleaned title, content and OCR text of a post, joined into one string
+        This is what gets stored as clean_text and fed to Doc2Vec, for training and inference alike
+        Posts without title or content text give "" (OCR text alone is not embedded)
+        """
+        if not (title and title.strip()) and not (selftext and selftext.strip()):
+            return ""
+        
+        # Each fragment is cleaned separately and joined once, instead of concatenating and re-cleaning
+        fragments = (
+            self.enhanced_text_cleaning(title),
+            self.enhanced_text_cleaning(selftext),
+            self.enhanced_text_cleaning(ocr_text),
+        )
+        return ' '.join(filter(None, fragments))
+
+    def load_corpus(self) -> List[str]:
+        """
+        Doc2Vec training corpus: every stored post, cleaned with post_embedding_text
+        The collection-phase clean_text is not used, its cleaning differs from what inference sees
+        """
+        conn = self.db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT title, selftext, ocr_text FROM reddit_posts")
+        corpus = [self.post_embedding_text(*row) for row in cursor]
+        cursor.close()
+        conn.close()
+        return [doc for doc in corpus if doc]
+
+    def _invalidate_embeddings(self):
+        """Clear stored embeddings so every post is re-embedded with the current model"""
+        conn = self.db_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE reddit_posts SET processed = FALSE, embedding = NULL "
+            "WHERE processed OR embedding IS NOT NULL"
+        )
+        if cursor.rowcount:
+            self.logger.info(f"New Doc2Vec model: {cursor.rowcount} posts queued for re-embedding")
+        cursor.close()
+        conn.close()
+
+    def fit_doc2vec(self, documents: List[str] = None) -> Doc2Vec:
+        """
+        Train Doc2Vec once over the whole corpus and persist it to DOC2VEC_MODEL_PATH
+        Batches then only infer vectors, so embeddings are comparable across batches
+        A new model has a new vector space, so embeddings from the old one are cleared
+        (before the model is saved or used) and those posts are processed again
+        Call before paging through posts: cleared rows behind the keyset cursor would be skipped
+        
+        Args:
+            documents: Training texts (defaults to every stored post, see load_corpus)
+            
+        Returns:
+            Trained model, or None if there is not enough text to train on
+        """
+        if documents is None:
+            documents = self.load_corpus()
+        
+        # Create tagged documents for training (each document tokenized exactly once)
+        tokenized = [_doc2vec_tokens(doc) for doc in documents]
+        tagged_docs = [
+            TaggedDocument(words=words, tags=[str(i)])
+            for i, words in enumerate(w for w in tokenized if w is not None)
+        ]
+        
+        if len(tagged_docs) < 2:
+            self.logger.warning("Not enough valid documents for Doc2Vec training")
+            return None
+        
+        # Train Doc2Vec model with lab-recommended parameters
+        self.logger.info(f"Training Doc2Vec on {len(tagged_docs)} documents...")
+        
+        model = Doc2Vec(
+            tagged_docs,
+            vector_size=100,      # 100-dimensional vectors
+            window=5,             # Context window size
+            min_count=2,          # Ignore words with freq < 2
+            workers=4,            # CPU cores to use
+            epochs=20,            # Training iterations
+            dm=1,                 # Distributed Memory model
+            alpha=0.025,          # Initial learning rate
+            min_alpha=0.00025,    # Final learning rate
+            sample=1e-4           # Threshold for word downsampling
+        )
+        
+        # Invalidate first: if this fails, no saved model exists whose vectors disagree with the DB
+        self._invalidate_embeddings()
+        model.save(DOC2VEC_MODEL_PATH)
+        self.logger.info(f"Saved Doc2Vec model to {DOC2VEC_MODEL_PATH}")
+        self.doc2vec = model
+        return model
+
+    def get_doc2vec(self) -> Doc2Vec:
+        """Saved Doc2Vec model, training it on first use"""
+        if self.doc2vec is None:
+            if os.path.exists(DOC2VEC_MODEL_PATH):
+                self.doc2vec = Doc2Vec.load(DOC2VEC_MODEL_PATH)
+            else:
+                self.fit_doc2vec()
+        return self.doc2vec
+
+    def generate_doc2vec_embeddings(self, documents: List[str]) -> Tuple[np.ndarray, Doc2Vec]:
         """
         Generate document embeddings using Doc2Vec
         Core feature engineering task as per lab requirements
+        Vectors are inferred from the shared model (see fit_doc2vec), not retrained per batch
         
         Args:
             documents: List of cleaned text documents
             
         Returns:
-            Tuple of (embeddings_list, trained_model)
+            Tuple of (embeddings array of shape (n, 100), trained_model)
         """
         try:
-            # Filter valid documents for training
-            valid_docs = []
-            doc_indices = []
-            
-            for i, doc in enumerate(documents):
-                if doc and doc.strip() and len(doc.strip()) > 10:
-                    valid_docs.append(doc.strip())
-                    doc_indices.append(i)
+            model = self.get_doc2vec()
+            if model is None:
+                return np.zeros((len(documents), 100), dtype=np.float32), None
             
-            if len(valid_docs) < 2:
-                self.logger.warning("Not enough valid documents for Doc2Vec training")
-                return [[0.0] * 100 for _ in documents], None
-            
-            # Create tagged documents for training
-            tagged_docs = [
-                TaggedDocument(words=doc.lower().split(), tags=[str(i)]) 
-                for i, doc in enumerate(valid_docs)
-            ]
-            
-            # Train Doc2Vec model with lab-recommended parameters
-            self.logger.info(f"Training Doc2Vec on {len(tagged_docs)} documents...")
-            
-            model = Doc2Vec(
-                tagged_docs,
-                vector_size=100,      # 100-dimensional vectors
-                window=5,             # Context window size
-                min_count=2,          # Ignore words with freq < 2
-                workers=4,            # CPU cores to use
-                epochs=20,            # Training iterations
-                dm=1,                 # Distributed Memory model
-                alpha=0.025,          # Initial learning rate
-                min_alpha=0.00025,    # Final learning rate
-                sample=1e-4           # Threshold for word downsampling
-            )
-            
-            # Generate embeddings for all documents
-            embeddings = []
-            valid_idx = 0
+            # Preallocated; rows of invalid documents stay zero vectors
+            embeddings = np.zeros((len(documents), model.vector_size), dtype=np.float32)
             
             for i, doc in enumerate(documents):
-                if i in doc_indices:
-                    try:
-                        # Get trained embedding
-                        embedding = model.dv[str(valid_idx)]
-                        embeddings.append(embedding.tolist())
-                        valid_idx += 1
-                    except (KeyError, IndexError):
-                        # Infer embedding for unseen document
-                        words = doc.lower().split()
-                        embedding = model.infer_vector(words)
-                        embeddings.append(embedding.tolist())
-                else:
-                    # Zero vector for invalid documents
-                    embeddings.append([0.0] * 100)
+                words = _doc2vec_tokens(doc)
+                if words is not None:
+                    # Infer embedding from the trained model
+                    embeddings[i] = model.infer_vector(words)
             
             self.logger.info(f"Generated {len(embeddings)} Doc2Vec embeddings (100D)")
             return embeddings, model
             
         except Exception as e:
             self.logger.error(f"Doc2Vec embedding generation failed: {e}")
-            return [[0.0] * 100 for _ in documents], None
+            return np.zeros((len(documents), 100), dtype=np.float32), None
 
-    def process_posts_batch(self, batch_size: int = 50) -> int:
+    def fetch_posts_batch(self, batch_size: int = 50, after_id: int = 0) -> List[Tuple]:
         """
-        Process a batch of posts from the database
-        Focus only on adding new features, preserve existing data
-        
-        Returns:
-            Number of posts processed
+        Fetch the next batch of unprocessed posts with id > after_id
+        Ordered by id so callers can page through without re-reading rows
         """
         conn = self.db_connection()
         cursor = conn.cursor()
         
-        # Get unprocessed posts (missing embeddings or OCR text)
+        # Get unprocessed posts; idx_processed (processed, id) makes this a range scan
         query = """
         SELECT id, title, selftext, url
         FROM reddit_posts 
-        WHERE embedding IS NULL OR ocr_text IS NULL
+        WHERE processed = FALSE AND id > %s
+        ORDER BY id
         LIMIT %s
         """
         
-        cursor.execute(query, (batch_size,))
+        cursor.execute(query, (after_id, batch_size))
         posts = cursor.fetchall()
+        cursor.close()
+        conn.close()
+        return posts
+
+    def process_posts_batch(self, batch_size: int = 50) -> int:
+        """
+        Process a batch of posts from the database
+        Focus only on adding new features, preserve existing data
+        
+        Returns:
+            Number of posts processed
+        """
+        posts = self.fetch_posts_batch(batch_size)
         
         if not posts:
             self.logger.info("No posts found to process")
-            cursor.close()
-            conn.close()
             return 0
         
+        return self.embed_and_store(posts)
+
+    def embed_and_store(self, posts: List[Tuple]) -> int:
+        """
+        Clean, OCR and embed a fetched batch, then write the features back
+        
+        Returns:
+            Number of posts processed
+        """
         self.logger.info(f"Processing {len(posts)} posts...")
         
+        # One connection serves the OCR cache lookups and the write-back
+        conn = self.db_connection()
+        try:
+            return self._embed_and_store(conn, posts)
+        finally:
+            conn.close()
+
+    def _embed_and_store(self, conn, posts: List[Tuple]) -> int:
+        # OCR every image URL in the batch up front, in parallel
+        ocr_by_url = self.ocr_urls([post[3] for post in posts], conn)
+        
         # Process each post
         processed_data = []
         texts_for_embedding = []
@@ -274,30 +640,11 @@ class RedditPreprocessor:
         for post in posts:
             post_id, title, selftext, url = post
             
-            # Combine title and content
-            full_text = f"{title or ''} {selftext or ''}".strip()
-            
-            if not full_text:
-                # Still process for OCR even if no text content
-                processed_data.append({
-                    'id': post_id,
-                    'cleaned_text': "",
-                    'ocr_text': self.extract_text_from_images(url) if url else ""
-                })
-                texts_for_embedding.append("empty")
-                continue
-            
-            # Enhanced text cleaning for embeddings
-            cleaned_text = self.enhanced_text_cleaning(full_text)
-            
             # OCR text extraction if URL points to image
-            ocr_text = ""
-            if url:
-                ocr_text = self.extract_text_from_images(url)
-                if ocr_text:
-                    # Add OCR text to cleaned content for embeddings
-                    ocr_cleaned = self.enhanced_text_cleaning(ocr_text)
-                    cleaned_text = f"{cleaned_text} {ocr_cleaned}".strip()
+            ocr_text = ocr_by_url.get(url, "") if url else ""
+            
+            # Enhanced text cleaning for embeddings (posts without text are still stored for OCR)
+            cleaned_text = self.post_embedding_text(title, selftext, ocr_text)
             
             processed_data.append({
                 'id': post_id,
@@ -306,7 +653,7 @@ class RedditPreprocessor:
             })
             
             # Prepare text for embedding generation
-            embedding_text = cleaned_text if cleaned_text.strip() else "empty"
+            embedding_text = cleaned_text or "empty"
             texts_for_embedding.append(embedding_text)
         
         # Generate embeddings for all texts
@@ -314,64 +661,61 @@ class RedditPreprocessor:
             embeddings, model = self.generate_doc2vec_embeddings(texts_for_embedding)
             
             # Update database with new features only
-            self._update_database_batch(processed_data, embeddings)
+            self._update_database_batch(conn, processed_data, embeddings)
         
-        cursor.close()
-        conn.close()
         return len(processed_data)
 
-    def _update_database_batch(self, processed_data: List[Dict], embeddings: List[List[float]]):
+    def _update_database_batch(self, conn, processed_data: List[Dict], embeddings: np.ndarray):
         """
         Update database with new features only
         Preserve existing keywords and is_ad from data collection
         """
-        conn = self.db_connection()
         cursor = conn.cursor()
         
-        # Update only new columns: clean_text, embedding, ocr_text
-        # Do NOT touch keywords or is_ad
-        update_query = """
-        UPDATE reddit_posts 
-        SET clean_text = %s, embedding = %s, ocr_text = %s
-        WHERE id = %s
-        """
-        
-        for i, data in enumerate(processed_data):
-            embedding_json = json.dumps(embeddings[i]) if i < len(embeddings) else None
-            
-            cursor.execute(update_query, (
+        # Cast the whole batch to the storage dtype once, then slice row blobs
+        embeddings = np.asarray(embeddings, dtype=EMBEDDING_DTYPE)
+        rows = [
+            (
+                data['id'],
                 data['cleaned_text'],
-                embedding_json,
-                data['ocr_text'],
-                data['id']
-            ))
-        
+                embeddings[i].tobytes() if i < len(embeddings) else None,
+                data['ocr_text']
+            )
+            for i, data in enumerate(processed_data)
+        ]
+        
+        # One transaction for the whole batch, one multi-row statement per packet-sized chunk
+        conn.start_transaction()
+        for chunk in _packet_chunks(rows):
+            params = [value for row in chunk for value in row]
+            cursor.execute(_multi_row_update_sql(len(chunk)), params)
         conn.commit()
         self.logger.info(f"Updated {len(processed_data)} posts with new features")
         
         cursor.close()
-        conn.close()
 
     def process_all_posts(self, batch_size: int = 50):
         """Process all unprocessed posts in the database"""
         self.logger.info("Starting focused preprocessing (HTML cleaning + OCR + embeddings)...")
+        # Load or fit the model before paging: a first fit re-queues every stored post
+        self.get_doc2vec()
+        self.start_ocr_pool()
         
         total_processed = 0
         batch_num = 1
+        # Keyset cursor: each batch resumes after the last id instead of rescanning from the start
+        last_id = 0
         
         while True:
             self.logger.info(f"Processing batch {batch_num}...")
-            processed_count = self.process_posts_batch(batch_size)
+            posts = self.fetch_posts_batch(batch_size, last_id)
             
-            if processed_count == 0:
+            if not posts:
                 break
             
-            total_processed += processed_count
+            total_processed += self.embed_and_store(posts)
+            last_id = posts[-1][0]
             batch_num += 1
-            
-            # Brief pause between batches
-            import time
-            time.sleep(1)
         
         self.logger.info(f"Focused preprocessing completed! Total processed: {total_processed}")
 
@@ -380,21 +724,18 @@ class RedditPreprocessor:
         conn = self.db_connection()
         cursor = conn.cursor()
         
-        # Get various counts
-        cursor.execute("SELECT COUNT(*) FROM reddit_posts")
-        total_posts = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM reddit_posts WHERE embedding IS NOT NULL")
-        posts_with_embeddings = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM reddit_posts WHERE ocr_text IS NOT NULL AND ocr_text != ''")
-        posts_with_ocr = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM reddit_posts WHERE keywords IS NOT NULL AND keywords != '[]'")
-        posts_with_keywords = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM reddit_posts WHERE clean_text IS NOT NULL AND clean_text != ''")
-        posts_with_clean_text = cursor.fetchone()[0]
+        # Get all counts in a single scan; SUM over booleans counts matching rows
+        cursor.execute("""
+            SELECT COUNT(*),
+                   SUM(embedding IS NOT NULL),
+                   SUM(ocr_text IS NOT NULL AND ocr_text != ''),
+                   SUM(keywords IS NOT NULL AND keywords != '[]'),
+                   SUM(clean_text IS NOT NULL AND clean_text != '')
+            FROM reddit_posts
+        """)
+        # SUM() comes back as Decimal, or NULL on an empty table
+        (total_posts, posts_with_embeddings, posts_with_ocr,
+         posts_with_keywords, posts_with_clean_text) = (int(v or 0) for v in cursor.fetchone())
         
         cursor.close()
         conn.close()
@@ -417,22 +758,25 @@ def main():
                        help='Batch size for processing')
     parser.add_argument('--stats', action='store_true',
                        help='Show preprocessing statistics')
+    parser.add_argument('--refit', action='store_true',
+                       help='Retrain the Doc2Vec model on the full corpus before processing')
     
     args = parser.parse_args()
     
-    preprocessor = RedditPreprocessor()
-    
-    if args.stats:
-        stats = preprocessor.get_preprocessing_stats()
-        print(f"\n=== Focused Preprocessing Statistics ===")
-        print(f"Total posts: {stats['total_posts']}")
-        print(f"Posts with embeddings: {stats['posts_with_embeddings']}")
-        print(f"Posts with OCR text: {stats['posts_with_ocr']}")
-        print(f"Posts with keywords (from data collection): {stats['posts_with_keywords']}")
-        print(f"Posts with enhanced clean text: {stats['posts_with_clean_text']}")
-        print(f"Completion: {stats['completion_percentage']:.1f}%")
-    else:
-        preprocessor.process_all_posts(batch_size=args.batch_size)
+    with RedditPreprocessor() as preprocessor:
+        if args.stats:
+            stats = preprocessor.get_preprocessing_stats()
+            print(f"\n=== Focused Preprocessing Statistics ===")
+            print(f"Total posts: {stats['total_posts']}")
+            print(f"Posts with embeddings: {stats['posts_with_embeddings']}")
+            print(f"Posts with OCR text: {stats['posts_with_ocr']}")
+            print(f"Posts with keywords (from data collection): {stats['posts_with_keywords']}")
+            print(f"Posts with enhanced clean text: {stats['posts_with_clean_text']}")
+            print(f"Completion: {stats['completion_percentage']:.1f}%")
+        else:
+            if args.refit:
+                preprocessor.fit_doc2vec()
+            preprocessor.process_all_posts(batch_size=args.batch_size)
 
 
 # if __name__ == "__main__":
@@ -1,6 +1,9 @@
 import os
+import orjson
+import numpy as np
 from dotenv import load_dotenv
 import mysql.connector as mysql
+from db_utils import EMBEDDING_DTYPE
 
 load_dotenv()
 
@@ -14,31 +17,115 @@ def db_conn():
         autocommit=True,
     )
 
-def ensure_column(cur, table, column, ddl):
+# Columns/indexes the preprocessing pipeline needs, as ALTER TABLE clause bodies
+REQUIRED_COLUMNS = [
+    ('embedding', "embedding VARBINARY(4096) DEFAULT NULL"),
+    ('ocr_text', "ocr_text TEXT DEFAULT NULL"),
+    ('processed', "processed BOOLEAN NOT NULL DEFAULT FALSE"),
+]
+REQUIRED_INDEXES = [
+    ('idx_created_utc', "idx_created_utc (created_utc)"),
+    ('idx_processed', "idx_processed (processed, id)"),
+]
+
+def existing_columns(cur, table):
     cur.execute(
-        "SELECT COUNT(*) FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s",
-        (table, column),
+        "SELECT COLUMN_NAME FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+        (table,),
     )
-    if cur.fetchone()[0] == 0:
-        cur.execute(ddl)
+    return {name for (name,) in cur.fetchall()}
 
-def ensure_index(cur, table, index_name, ddl):
+def existing_indexes(cur, table):
     cur.execute(
-        "SELECT COUNT(*) FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s",
-        (table, index_name),
+        "SELECT DISTINCT INDEX_NAME FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+        (table,),
     )
-    if cur.fetchone()[0] == 0:
+    return {name for (name,) in cur.fetchall()}
+
+def alter_table(cur, table, clauses, options):
+    """Apply all clauses in one ALTER TABLE; fall back to MySQL's default algorithm if `options` is unsupported."""
+    if not clauses:
+        return
+    ddl = f"ALTER TABLE {table} " + ", ".join(clauses)
+    try:
+        cur.execute(f"{ddl}, {options}")
+    except mysql.Error:
+        # Older server, or the requested algorithm can't apply to this change
         cur.execute(ddl)
 
+def _json_embedding_to_blob(raw):
+    """float16 bytes for a JSON embedding, or None unless it is a non-empty flat list of finite numbers"""
+    try:
+        data = orjson.loads(raw)
+    except (orjson.JSONDecodeError, TypeError):
+        return None
+    if not isinstance(data, list) or not data or not all(type(x) in (int, float) for x in data):
+        return None
+    vec = np.asarray(data, dtype=EMBEDDING_DTYPE)
+    return vec.tobytes() if np.isfinite(vec).all() else None
+
+def migrate_embedding_to_binary(cur):
+    """Convert a legacy JSON `embedding` column to float16 VARBINARY in place.
+
+    DDL commits implicitly, so each step checks what an interrupted earlier run
+    already did: a leftover `embedding_bin` is reused, and a run that died after
+    dropping the JSON column only has the rename left.
+    """
+    cur.execute(
+        "SELECT COLUMN_NAME, DATA_TYPE FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() "
+        "AND TABLE_NAME = 'reddit_posts' AND COLUMN_NAME IN ('embedding', 'embedding_bin')"
+    )
+    types = {name: data_type.lower() for name, data_type in cur.fetchall()}
+    if 'embedding' not in types and 'embedding_bin' in types:
+        cur.execute("ALTER TABLE reddit_posts RENAME COLUMN embedding_bin TO embedding")
+        print("Finished an interrupted embedding conversion.")
+        return
+    if types.get('embedding') != 'json':
+        return
+    if 'embedding_bin' not in types:
+        cur.execute("ALTER TABLE reddit_posts ADD COLUMN embedding_bin VARBINARY(4096) DEFAULT NULL")
+    cur.execute("SELECT id, embedding FROM reddit_posts WHERE embedding IS NOT NULL")
+    rows, skipped = [], []
+    for rid, emb in cur.fetchall():
+        blob = _json_embedding_to_blob(emb)
+        if blob is None:
+            skipped.append(rid)
+        else:
+            rows.append((blob, rid))
+    cur.executemany("UPDATE reddit_posts SET embedding_bin = %s WHERE id = %s", rows)
+    if skipped:
+        # Left with a NULL embedding; make sure preprocessing picks them up again
+        if 'processed' in existing_columns(cur, 'reddit_posts'):
+            cur.executemany("UPDATE reddit_posts SET processed = FALSE WHERE id = %s", [(rid,) for rid in skipped])
+        print(f"[WARN] Skipped {len(skipped)} embeddings that are not 1-D numeric lists; they will be re-embedded.")
+    cur.execute("ALTER TABLE reddit_posts DROP COLUMN embedding")
+    cur.execute("ALTER TABLE reddit_posts RENAME COLUMN embedding_bin TO embedding")
+    print(f"Converted {len(rows)} JSON embeddings to float16 VARBINARY.")
+
 def main():
     conn = db_conn()
     cur = conn.cursor()
-    ensure_column(cur, 'reddit_posts', 'embedding',
-                  "ALTER TABLE reddit_posts ADD COLUMN embedding JSON DEFAULT NULL")
-    ensure_column(cur, 'reddit_posts', 'ocr_text',
-                  "ALTER TABLE reddit_posts ADD COLUMN ocr_text TEXT DEFAULT NULL")
-    ensure_index(cur, 'reddit_posts', 'idx_created_utc',
-                 "ALTER TABLE reddit_posts ADD INDEX idx_created_utc (created_utc)")
+    migrate_embedding_to_binary(cur)
+    
+    # Nullable/defaulted column adds are metadata-only with INSTANT (MySQL 8.0.12+)
+    columns = existing_columns(cur, 'reddit_posts')
+    missing = [(name, clause) for name, clause in REQUIRED_COLUMNS if name not in columns]
+    alter_table(cur, 'reddit_posts', [f"ADD COLUMN {clause}" for _, clause in missing], "ALGORITHM=INSTANT")
+    if any(name == 'processed' for name, _ in missing):
+        # Rows preprocessed before the flag existed
+        cur.execute("UPDATE reddit_posts SET processed = TRUE WHERE embedding IS NOT NULL AND ocr_text IS NOT NULL")
+    
+    # Index builds can't be INSTANT; build them all in one online INPLACE pass
+    indexes = existing_indexes(cur, 'reddit_posts')
+    alter_table(cur, 'reddit_posts',
+                [f"ADD INDEX {clause}" for name, clause in REQUIRED_INDEXES if name not in indexes],
+                "ALGORITHM=INPLACE, LOCK=NONE")
+    cur.execute(
+        "CREATE TABLE IF NOT EXISTS ocr_cache ("
+        "url_sha1 CHAR(40) PRIMARY KEY, "
+        "ocr_text TEXT, "
+        "created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+    )
     cur.close()
     conn.close()
     print("Migration checks/executions done.")
@@ -13,12 +13,14 @@ CREATE TABLE IF NOT EXISTS reddit_posts (
   is_ad BOOLEAN,
   keywords JSON,
   clean_text MEDIUMTEXT,
-  embedding JSON,
+  embedding VARBINARY(4096),
+  processed BOOLEAN NOT NULL DEFAULT FALSE,
   cluster_id INT NULL,
   created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
 CREATE INDEX idx_subreddit_created ON reddit_posts (subreddit, created_utc);
+CREATE INDEX idx_processed ON reddit_posts (processed, id);
 
 
 CREATE TABLE IF NOT EXISTS cluster_metadata (
@@ -27,4 +29,11 @@ CREATE TABLE IF NOT EXISTS cluster_metadata (
   representative_post_id BIGINT,
   created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
   FOREIGN KEY (representative_post_id) REFERENCES reddit_posts(id)
-);
\ No newline at end of file
+);
+
+-- OCR results keyed by sha1(image url), so reposted images are not downloaded/OCR'd again
+CREATE TABLE IF NOT EXISTS ocr_cache (
+  url_sha1 CHAR(40) PRIMARY KEY,
+  ocr_text TEXT,
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);